@@ -1,120 +1,47 @@
+import io
+import logging
 import pandas as pd
-import requests
-import time, random, io
 import streamlit as st
 from streamlit_lottie import st_lottie
 
-
-# ------------------ Core Functions ------------------
-def get_pubchem_info(compound_name):
-    url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/name/{compound_name}/property/SMILES,InChIKey,MolecularFormula,XLogP/JSON"
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        props = response.json()['PropertyTable']['Properties'][0]
-        return {
-            'Compound Name': compound_name,
-            'SMILES': props.get('SMILES'),
-            'InChIKey': props.get('InChIKey'),
-            'Molecular Formula': props.get('MolecularFormula'),
-            'Lipophilicity (XLogP)': props.get('XLogP')
-        }
-    except Exception:
-        return None
+from chemextractor.core import SESSION, process
 
 
-def get_classyfire_info(inchikey, retries=3, base_delay=1.5):
-    if not inchikey:
-        return {'Class': None, 'Subclass': None, 'Superclass': None}
-    for attempt in range(retries):
-        try:
-            url = f"http://classyfire.wishartlab.com/entities/{inchikey}.json"
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            d = response.json()
-            return {
-                'Class': d.get('class', {}).get('name'),
-                'Subclass': d.get('subclass', {}).get('name'),
-                'Superclass': d.get('superclass', {}).get('name')
-            }
-        except Exception:
-            time.sleep(base_delay + random.uniform(0, 1.5))
-    return {'Class': None, 'Subclass': None, 'Superclass': None}
+# Streamlit only configures its own loggers; without this the core module's
+# INFO records (e.g. negotiated Content-Encoding) are dropped.
+core_logger = logging.getLogger("chemextractor")
+if not core_logger.handlers:
+    core_logger.addHandler(logging.StreamHandler())
+    core_logger.setLevel(logging.INFO)
 
 
 def process_file(uploaded_file):
-    df = pd.read_excel(uploaded_file)
+    df = pd.read_excel(uploaded_file, engine="calamine", usecols=[0])
     compound_names = df.iloc[:, 0].dropna().unique()
 
-    st.info("Fetching PubChem data sequentially with rate limiting...")
-    pubchem_results = []
+    st.info("Fetching PubChem data and ClassyFire annotations concurrently...")
     progress_text = st.empty()
     progress_bar = st.progress(0)
 
-    for i, compound in enumerate(compound_names):
-        data = None
-        retries = 3
-        delay = 1
-        while retries > 0:
-            data = get_pubchem_info(compound)
-            if data is not None:
-                break
-            else:
-                time.sleep(delay)
-                delay *= 2
-                retries -= 1
-
-        if data:
-            pubchem_results.append(data)
-        else:
-            pubchem_results.append({
-                'Compound Name': compound,
-                'SMILES': None,
-                'InChIKey': None,
-                'Molecular Formula': None,
-                'Lipophilicity (XLogP)': None
-            })
-
-        progress_bar.progress((i + 1) / len(compound_names) * 0.5)
-        progress_text.text(f"Fetched PubChem data for {i + 1}/{len(compound_names)} compounds")
-        time.sleep(0.25)
-
-    st.info("Annotating with ClassyFire sequentially with rate limiting...")
-    final_results = []
-    for i, item in enumerate(pubchem_results):
-        inchikey = item['InChIKey']
-        retries = 3
-        delay = 1
-        classy = None
-        while retries > 0:
-            classy = get_classyfire_info(inchikey)
-            if classy['Class'] is not None:
-                break
-            else:
-                time.sleep(delay)
-                delay *= 2
-                retries -= 1
-
-        if classy:
-            combined = {**item, **classy}
-        else:
-            combined = {**item, 'Class': None, 'Subclass': None, 'Superclass': None}
+    def on_progress(done, total):
+        progress_bar.progress(done / total)
+        progress_text.text(f"Processed {done}/{total} compounds")
 
-        final_results.append(combined)
-        progress_bar.progress(0.5 + (i + 1) / len(pubchem_results) * 0.5)
-        progress_text.text(f"Classified {i + 1}/{len(pubchem_results)} compounds")
-        time.sleep(0.25)
+    # process() runs its event loop on this script thread, so the callback
+    # can update Streamlit elements directly. Reruns with the same sheet are
+    # served from the core disk cache, which keeps failed lookups only for
+    # NEGATIVE_CACHE_TTL.
+    result_df = process(compound_names, on_progress)
 
     st.success("✅ Done! All compounds processed successfully.")
     st.success("Incomplete details for certain compounds may have occurred due to API limits or missing data.")
-    result_df = pd.DataFrame(final_results)
     return result_df
 
 
 # ------------------ Load Animation ------------------
 def load_lottie_url(url):
     try:
-        r = requests.get(url)
+        r = SESSION.get(url, timeout=10)
         if r.status_code != 200:
             return None
         return r.json()
@@ -202,13 +129,16 @@ if uploaded_file:
 
             st.dataframe(result_df, use_container_width=True)
 
+            # xlsxwriter serializes faster than openpyxl. constant_memory is
+            # left off because pandas writes cells column by column, which
+            # that mode silently drops.
             buffer = io.BytesIO()
-            result_df.to_excel(buffer, index=False)
-            buffer.seek(0)
+            with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
+                result_df.to_excel(writer, index=False)
 
             st.download_button(
                 label="📥 Download Processed Data (Excel)",
-                data=buffer,
+                data=buffer.getvalue(),
                 file_name="ChemicalData_Output.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
@@ -0,0 +1,529 @@
+import asyncio
+import contextlib
+import email.utils
+import functools
+import logging
+import math
+import os
+import random
+import threading
+import time
+import urllib.parse
+from collections import deque
+
+import aiohttp
+import diskcache
+import numpy as np
+import orjson
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+HTTP_HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "User-Agent": "ChemExtractor/1.0",
+    "Accept": "application/json",
+}
+
+SESSION = requests.Session()
+SESSION.headers.update(HTTP_HEADERS)
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=0))
+SESSION.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+
+# PubChem/ClassyFire lookups survive across runs; failures expire quickly so a
+# transient 429 does not hide a compound for a month.
+CACHE = diskcache.Cache(os.path.expanduser("~/.chemextractor_cache"))
+CACHE_TTL = 30 * 24 * 3600
+NEGATIVE_CACHE_TTL = 3600
+
+
+# ------------------ Adaptive Concurrency ------------------
+def wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class AIMDController:
+    # TCP-style concurrency limit: once per window of `window` completions,
+    # grow by `alpha` if mean latency stayed under target; halve at most once
+    # per window on throttling/server errors; and park every caller for
+    # `breaker_cooldown` seconds after a burst of consecutive failures.
+    def __init__(self, initial=4, alpha=0.5, beta=0.5, min_limit=1, max_limit=32,
+                 window=32, latency_target=1.5, breaker_threshold=5, breaker_cooldown=30):
+        self.c_t = initial
+        self.alpha = alpha
+        self.beta = beta
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window = window
+        self.latency_target = latency_target
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.latencies = deque(maxlen=window)
+        self.completions = 0
+        self.decreased = False
+        self.consecutive_failures = 0
+        self.breaker_open_until = 0.0
+        self.in_flight = 0
+        self._waiters = deque()
+        # Shared by every Streamlit session, each running its own event loop
+        # on its own script thread.
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        while True:
+            with self._lock:
+                wait = self.breaker_open_until - time.monotonic()
+                if wait <= 0:
+                    if self.in_flight < int(self.c_t):
+                        self.in_flight += 1
+                        return
+                    waiter = asyncio.get_running_loop().create_future()
+                    self._waiters.append(waiter)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            else:
+                await waiter
+
+    def _pop_runnable(self):
+        # Waiters to wake for the free capacity, oldest first; called with
+        # the lock held.
+        runnable = []
+        while self._waiters and len(runnable) < int(self.c_t) - self.in_flight:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                runnable.append(waiter)
+        return runnable
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            runnable = self._pop_runnable()
+        for waiter in runnable:
+            waiter.get_loop().call_soon_threadsafe(wake, waiter)
+
+    def _complete(self):
+        # Close the window every `window` completions; called with the lock
+        # held.
+        self.completions += 1
+        if self.completions < self.window:
+            return
+        if not self.decreased and sum(self.latencies) / len(self.latencies) <= self.latency_target:
+            self.c_t = min(self.max_limit, self.c_t + self.alpha)
+        self.completions = 0
+        self.decreased = False
+
+    def record_success(self, latency):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.latencies.append(latency)
+            self._complete()
+
+    def record_failure(self):
+        with self._lock:
+            # A burst of in-flight failures is one congestion event.
+            if not self.decreased:
+                self.c_t = max(self.min_limit, self.c_t * self.beta)
+                self.decreased = True
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.breaker_threshold:
+                self.breaker_open_until = time.monotonic() + self.breaker_cooldown
+                self.consecutive_failures = 0
+            self._complete()
+
+    @staticmethod
+    def is_congestion(exc):
+        # 404s and malformed payloads say nothing about server load.
+        if isinstance(exc, aiohttp.ClientResponseError):
+            return exc.status == 429 or exc.status >= 500
+        return isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError))
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        # Yields a callable that restarts the latency clock, so time spent
+        # pacing inside the slot is not counted as server latency.
+        await self.acquire()
+        t0 = [time.monotonic()]
+
+        def mark_sent():
+            t0[0] = time.monotonic()
+
+        try:
+            yield mark_sent
+        except Exception as exc:
+            if self.is_congestion(exc):
+                self.record_failure()
+            raise
+        else:
+            self.record_success(time.monotonic() - t0[0])
+        finally:
+            self.release()
+
+
+CLASSYFIRE_LIMITER = AIMDController()
+
+
+class TokenBucket:
+    # Paces requests to `rps` per second with up to `burst` sent back to back.
+    # A throttled response cuts the rate by `beta` until `decay` seconds pass.
+    def __init__(self, rps, burst, beta=0.5, decay=30, min_rps=0.5):
+        self.base_rps = rps
+        self.rps = rps
+        self.burst = burst
+        self.beta = beta
+        self.decay = decay
+        self.min_rps = min_rps
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.restore_at = 0.0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.restore_at and now >= self.restore_at:
+            self.rps = self.base_rps
+            self.restore_at = 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rps)
+        self.updated = now
+
+    async def acquire(self, host):
+        # Callers queue in FIFO order and only the head polls the bucket, so
+        # each token costs one wake-up rather than one per waiter. The head
+        # takes a token only once one is available at the current rate and
+        # the host is not deferred, re-checking both after every sleep so a
+        # 429 or Retry-After also reschedules callers that are already waiting.
+        waiter = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self._waiters.append(waiter)
+            is_head = self._waiters[0] is waiter
+        try:
+            if not is_head:
+                await waiter
+            while True:
+                await wait_for_host(host)
+                with self._lock:
+                    self._refill(time.monotonic())
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rps
+                await asyncio.sleep(wait)
+        finally:
+            # Hand the head of the queue on, also when cancelled.
+            with self._lock:
+                was_head = self._waiters[0] is waiter
+                self._waiters.remove(waiter)
+                successor = self._waiters[0] if was_head and self._waiters else None
+            if successor is not None:
+                successor.get_loop().call_soon_threadsafe(wake, successor)
+
+    def backoff(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rps = max(self.min_rps, self.rps * self.beta)
+            self.restore_at = time.monotonic() + self.decay
+
+
+PUBCHEM_BUCKET = TokenBucket(rps=5, burst=5)
+CLASSYFIRE_BUCKET = TokenBucket(rps=3, burst=3)
+
+
+# ------------------ Rate Limit Headers ------------------
+PUBCHEM_HOST = "pubchem.ncbi.nlm.nih.gov"
+CLASSYFIRE_HOST = "classyfire.wishartlab.com"
+THROTTLE_STATUSES = (429, 503)
+RATE_LIMIT_THRESHOLD = 0.1
+# NEXT_REQUEST_AT is shared by every session in the process, so a host is
+# never parked longer than this; lookups still throttled after the wait fail
+# through the normal retry path and show up as incomplete rows.
+MAX_HOST_DEFERRAL = 30
+
+# Earliest time.monotonic() at which each host may be queried again.
+NEXT_REQUEST_AT = {}
+
+
+def parse_retry_after(value, default):
+    # Retry-After is either a number of seconds or an HTTP-date.
+    if value is None:
+        return default
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError, OverflowError):
+            return default
+    if not math.isfinite(delay):
+        return default
+    return max(0.0, delay)
+
+
+def defer_host(host, delay):
+    if not math.isfinite(delay):
+        return
+    until = time.monotonic() + min(max(0.0, delay), MAX_HOST_DEFERRAL) + random.uniform(0, 0.5)
+    NEXT_REQUEST_AT[host] = max(NEXT_REQUEST_AT.get(host, 0.0), until)
+
+
+def note_rate_limit(host, headers):
+    remaining = headers.get("X-RateLimit-Remaining")
+    reset = headers.get("X-RateLimit-Reset")
+    if remaining is None or reset is None:
+        return
+    try:
+        remaining = float(remaining)
+        reset = float(reset)
+        limit = float(headers.get("X-RateLimit-Limit", 0))
+    except ValueError:
+        return
+    if remaining <= limit * RATE_LIMIT_THRESHOLD:
+        # Reset is sent either as an epoch timestamp or as seconds from now.
+        delay = reset - time.time() if reset > 1e9 else reset
+        defer_host(host, max(0.0, delay))
+
+
+# Hosts whose response encoding has already been logged.
+LOGGED_ENCODINGS = set()
+
+
+def log_content_encoding(host, headers):
+    # Called only after raise_for_status(), so error bodies are never logged.
+    if host not in LOGGED_ENCODINGS:
+        LOGGED_ENCODINGS.add(host)
+        logger.info("%s responded with Content-Encoding: %s", host, headers.get("Content-Encoding", "identity"))
+
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20
+
+
+def next_backoff(delay):
+    # Decorrelated jitter: each retry waits a random time between the base and
+    # three times the previous wait, so concurrent callers that failed
+    # together do not retry together.
+    return min(BACKOFF_CAP, random.uniform(BACKOFF_BASE, delay * 3))
+
+
+async def wait_for_host(host):
+    delay = NEXT_REQUEST_AT.get(host, 0.0) - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+# ------------------ Core Functions ------------------
+PUBCHEM_COLUMNS = ['Compound Name', 'SMILES', 'InChIKey', 'Molecular Formula', 'Lipophilicity (XLogP)']
+CLASSYFIRE_COLUMNS = ['Class', 'Subclass', 'Superclass']
+
+PUBCHEM_URL_L = "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/name/"
+PUBCHEM_URL_R = "/property/SMILES,InChIKey,MolecularFormula,XLogP/JSON"
+CLASSYFIRE_URL_L = "http://classyfire.wishartlab.com/entities/"
+CLASSYFIRE_URL_R = ".json"
+
+
+@functools.lru_cache(maxsize=8192)
+def quote_cached(value):
+    # Names with spaces, slashes or other reserved characters must be
+    # percent-encoded or PubChem answers 404.
+    return urllib.parse.quote(value, safe="")
+
+
+async def get_pubchem_info(session, compound_name):
+    # PUG-REST only accepts comma-separated lists for numeric namespaces
+    # (cid/sid/aid); the name namespace takes a single name per request and
+    # the properties it returns carry no reference back to the input name,
+    # so name lookups stay one request each over the pooled connector.
+    url = PUBCHEM_URL_L + quote_cached(compound_name) + PUBCHEM_URL_R
+    await PUBCHEM_BUCKET.acquire(PUBCHEM_HOST)
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            note_rate_limit(PUBCHEM_HOST, response.headers)
+            if response.status in THROTTLE_STATUSES:
+                PUBCHEM_BUCKET.backoff()
+                defer_host(PUBCHEM_HOST, parse_retry_after(response.headers.get("Retry-After"), 1))
+            response.raise_for_status()
+            log_content_encoding(PUBCHEM_HOST, response.headers)
+            js = orjson.loads(await response.read())
+        props = js['PropertyTable']['Properties'][0]
+        return {
+            'Compound Name': compound_name,
+            'SMILES': props.get('SMILES'),
+            'InChIKey': props.get('InChIKey'),
+            'Molecular Formula': props.get('MolecularFormula'),
+            'Lipophilicity (XLogP)': props.get('XLogP')
+        }
+    except Exception:
+        return None
+
+
+async def get_classyfire_info(session, inchikey, retries=3, base_delay=1.5):
+    if not inchikey:
+        return {'Class': None, 'Subclass': None, 'Superclass': None}
+    url = CLASSYFIRE_URL_L + quote_cached(inchikey) + CLASSYFIRE_URL_R
+    delay = BACKOFF_BASE
+    for attempt in range(retries):
+        try:
+            async with CLASSYFIRE_LIMITER.slot() as mark_sent:
+                await CLASSYFIRE_BUCKET.acquire(CLASSYFIRE_HOST)
+                mark_sent()
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    note_rate_limit(CLASSYFIRE_HOST, response.headers)
+                    if response.status in THROTTLE_STATUSES:
+                        CLASSYFIRE_BUCKET.backoff()
+                        defer_host(CLASSYFIRE_HOST, parse_retry_after(response.headers.get("Retry-After"), base_delay))
+                    response.raise_for_status()
+                    log_content_encoding(CLASSYFIRE_HOST, response.headers)
+                    d = orjson.loads(await response.read())
+            return {
+                'Class': d.get('class', {}).get('name'),
+                'Subclass': d.get('subclass', {}).get('name'),
+                'Superclass': d.get('superclass', {}).get('name')
+            }
+        except aiohttp.ClientResponseError as exc:
+            # Throttled responses already pushed back the host's next slot.
+            if exc.status not in THROTTLE_STATUSES:
+                delay = next_backoff(delay)
+                await asyncio.sleep(delay)
+        except Exception:
+            delay = next_backoff(delay)
+            await asyncio.sleep(delay)
+    return {'Class': None, 'Subclass': None, 'Superclass': None}
+
+
+async def fetch_pubchem(session, compound):
+    # Keyed on the same strip/casefold normalization process() dedupes on,
+    # so "Aspirin" in one sheet and "aspirin" in the next share an entry.
+    key = ("pubchem", str(compound).strip().casefold())
+    cached = CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    data = None
+    retries = 3
+    delay = BACKOFF_BASE
+    while retries > 0:
+        data = await get_pubchem_info(session, compound)
+        if data is not None:
+            break
+        else:
+            delay = next_backoff(delay)
+            await asyncio.sleep(delay)
+            retries -= 1
+
+    if data:
+        CACHE.set(key, data, expire=CACHE_TTL)
+        return data
+    data = {
+        'Compound Name': compound,
+        'SMILES': None,
+        'InChIKey': None,
+        'Molecular Formula': None,
+        'Lipophilicity (XLogP)': None
+    }
+    CACHE.set(key, data, expire=NEGATIVE_CACHE_TTL)
+    return data
+
+
+async def fetch_classyfire(session, item):
+    inchikey = item['InChIKey']
+    if not inchikey:
+        return {'Class': None, 'Subclass': None, 'Superclass': None}
+    key = ("classyfire", inchikey)
+    classy = CACHE.get(key)
+    if classy is not None:
+        return classy
+
+    retries = 3
+    delay = BACKOFF_BASE
+    classy = None
+    while retries > 0:
+        classy = await get_classyfire_info(session, inchikey)
+        if classy['Class'] is not None:
+            break
+        else:
+            delay = next_backoff(delay)
+            await asyncio.sleep(delay)
+            retries -= 1
+
+    CACHE.set(key, classy, expire=CACHE_TTL if classy['Class'] is not None else NEGATIVE_CACHE_TTL)
+
+    if classy:
+        return classy
+    return {'Class': None, 'Subclass': None, 'Superclass': None}
+
+
+async def gather_with_progress(coros, on_result, on_progress):
+    # Run all coroutines concurrently, handing each result to `on_result`
+    # with its input position. Progress is reported about every 1% rather
+    # than per completion, since each report re-renders the UI. Reports run
+    # inline in the completion loop so Streamlit's stop/rerun exceptions
+    # propagate instead of being parked on a background task.
+    async def indexed(i, coro):
+        return i, await coro
+
+    tasks = [indexed(i, coro) for i, coro in enumerate(coros)]
+    step = max(1, len(tasks) // 100)
+    for done, future in enumerate(asyncio.as_completed(tasks), start=1):
+        i, result = await future
+        on_result(i, result)
+        if done % step == 0 or done == len(tasks):
+            on_progress(done)
+
+
+async def fetch_compound(session, compound):
+    # ClassyFire only needs the InChIKey, so each compound moves on to it as
+    # soon as its own PubChem lookup returns; the two hosts overlap.
+    item = await fetch_pubchem(session, compound)
+    return item, await fetch_classyfire(session, item)
+
+
+async def fetch_all(compound_names, on_progress):
+    # One preallocated array per output column, filled by position, so each
+    # source's DataFrame is built straight from columns.
+    pubchem_columns = {col: np.empty(len(compound_names), dtype=object) for col in PUBCHEM_COLUMNS}
+    classyfire_columns = {col: np.empty(len(compound_names), dtype=object) for col in CLASSYFIRE_COLUMNS}
+
+    def on_result(i, result):
+        item, classy = result
+        for col, values in pubchem_columns.items():
+            values[i] = item[col]
+        for col, values in classyfire_columns.items():
+            values[i] = classy[col]
+
+    connector = aiohttp.TCPConnector(limit=32, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector, headers=HTTP_HEADERS) as session:
+        await gather_with_progress(
+            [fetch_compound(session, compound) for compound in compound_names], on_result, on_progress
+        )
+    return pubchem_columns, classyfire_columns
+
+
+def process(compound_names, on_progress=None):
+    # Look up every name and return one row per input name, in input order.
+    # `on_progress(done, total)` is called as compounds finish.
+    names = pd.Series(compound_names, dtype=object)
+
+    # "Aspirin", "aspirin " and "ASPIRIN" share one lookup; each spelling
+    # still gets its own output row.
+    stripped = names.astype(str).str.strip()
+    normalized = stripped.str.casefold()
+    unique_keys = normalized.drop_duplicates()
+    unique_names = stripped[unique_keys.index].tolist()
+
+    def report(done):
+        if on_progress is not None:
+            on_progress(done, len(unique_names))
+
+    pubchem_columns, classyfire_columns = asyncio.run(fetch_all(unique_names, report))
+
+    # Both column sets share the same row order, so they are joined side by
+    # side instead of merging a dict per compound.
+    index = unique_keys.tolist()
+    unique_df = pd.concat(
+        [pd.DataFrame(pubchem_columns, index=index), pd.DataFrame(classyfire_columns, index=index)], axis=1
+    ).infer_objects()
+    result_df = unique_df.drop(columns='Compound Name').reindex(normalized.tolist())
+    result_df.insert(0, 'Compound Name', names.tolist())
+    return result_df.reset_index(drop=True)